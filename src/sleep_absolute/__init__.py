@@ -1,18 +1,20 @@
 """Async utilities to wait until an absolute timestamp.
 
 The :func:`wait_until` helper selects the optimal implementation for the
-current platform.  On Linux it uses ``timerfd`` via :mod:`ctypes`, falling back
-to POSIX timers (``timer_create``/``timer_settime``) when necessary.  Windows
-relies on waitable timers.  Other platforms are currently not supported.
+current platform.  On Linux it uses ``timerfd`` (through :mod:`os` on Python
+3.13+ and :mod:`ctypes` otherwise), falling back to POSIX timers
+(``timer_create``/``timer_settime``) when necessary.  Windows relies on
+waitable timers.  Other platforms are currently not supported.
+:func:`wait_until_many` registers several targets in one call.
 """
 from __future__ import annotations
 
-from typing import Optional
+from typing import Iterable, List, Optional
 import asyncio as _asyncio
 import datetime as _datetime
 import sys as _sys
 
-__all__ = ["wait_until", "__version__"]
+__all__ = ["wait_until", "wait_until_many", "__version__"]
 __version__ = "0.1.0"
 
 if _sys.platform.startswith("linux"):
@@ -56,3 +58,29 @@ def wait_until(
         raise NotImplementedError("sleep_absolute.wait_until is not available on this platform")
     return _impl.wait_until(target_time, loop=loop)
 
+
+def wait_until_many(
+    target_times: Iterable[_datetime.datetime],
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> List[_asyncio.Future]:
+    """Return one future per entry of ``target_times``, in the same order.
+
+    On Linux and Windows the waits are added to the loop's shared timer in a
+    single batch, so the timer is re-armed at most once for the whole set.
+
+    Args:
+        target_times: Absolute points in time; they need not be sorted.
+        loop: Event loop instance, resolved as for :func:`wait_until`.
+
+    Returns:
+        List of ``asyncio.Future`` objects, each resolving to :data:`None` once
+        its target is reached.  Each future can be cancelled independently.
+
+    Raises:
+        NotImplementedError: if the current platform is unsupported.
+    """
+    if _impl is None:
+        raise NotImplementedError(
+            "sleep_absolute.wait_until_many is not available on this platform"
+        )
+    return _impl.wait_until_many(target_times, loop=loop)
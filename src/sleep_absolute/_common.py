@@ -0,0 +1,286 @@
+"""Helpers shared by the platform specific implementations."""
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+import asyncio as _asyncio
+import datetime as _datetime
+import heapq as _heapq
+import itertools as _itertools
+import math as _math
+import time as _time
+import weakref as _weakref
+
+_EPOCH = _datetime.datetime(1970, 1, 1, tzinfo=_datetime.timezone.utc)
+
+# asyncio runs a ``call_later`` handle once it is within the monotonic clock's
+# resolution of its deadline, so short waits are padded by that much.
+_CLOCK_RESOLUTION_NS = _math.ceil(_time.get_clock_info("monotonic").resolution * 1e9)
+
+# Targets closer than this are scheduled with ``loop.call_later``.  Coarse
+# clocks (~15.6ms on Windows before Python 3.13) would turn the padding into
+# an oversleep, so there only targets already in the past take the shortcut.
+_SHORT_WAIT_NS = 2_000_000 if _CLOCK_RESOLUTION_NS * 10 <= 2_000_000 else 0
+
+
+def _datetime_to_ns(target_time: _datetime.datetime) -> int:
+    """Return ``target_time`` as integer nanoseconds since the Unix epoch.
+
+    The result is exact.  Naive datetimes are interpreted as local time,
+    matching :meth:`datetime.datetime.timestamp`.
+    """
+    if target_time.utcoffset() is None:
+        # timestamp() applies the local UTC offset in C, several times faster
+        # than astimezone().  Its float error is far below half a second, so
+        # rounding off the microseconds recovers the whole seconds exactly.
+        microsecond = target_time.microsecond
+        seconds = round(target_time.timestamp() - microsecond / 1_000_000)
+        return seconds * 1_000_000_000 + microsecond * 1000
+    delta = target_time - _EPOCH
+    return (
+        delta.days * 86_400_000_000_000
+        + delta.seconds * 1_000_000_000
+        + delta.microseconds * 1000
+    )
+
+
+def _set_result_unless_done(future: _asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _ensure_loop(loop: Optional[_asyncio.AbstractEventLoop]) -> _asyncio.AbstractEventLoop:
+    """Return ``loop``, the running loop, or the policy's default loop.
+
+    ``get_running_loop()`` is a cheap thread-local lookup; the policy is only
+    consulted when called outside a running loop.
+    """
+    if loop is not None:
+        return loop
+    try:
+        return _asyncio.get_running_loop()
+    except RuntimeError:
+        return _asyncio.get_event_loop()
+
+
+def _short_wait(
+    target_ns: int,
+    loop: _asyncio.AbstractEventLoop,
+) -> Optional[_asyncio.Future]:
+    """Schedule waits shorter than :data:`_SHORT_WAIT_NS` on the loop itself.
+
+    Arming a native timer costs several syscalls, which is wasted when the
+    target is within a loop tick.  ``target_ns`` comes from
+    :func:`_datetime_to_ns`.  Returns :data:`None` for longer waits.
+    """
+    delta_ns = target_ns - _time.time_ns()
+    if delta_ns <= 0:
+        future = loop.create_future()
+        loop.call_soon(_set_result_unless_done, future)
+    elif delta_ns < _SHORT_WAIT_NS:
+        future = loop.create_future()
+        delay = (delta_ns + _CLOCK_RESOLUTION_NS) / 1_000_000_000
+        loop.call_later(delay, _set_result_unless_done, future)
+    else:
+        return None
+    return future
+
+
+def _wait_each(
+    wait_until: Callable[..., _asyncio.Future],
+    target_times: Iterable[_datetime.datetime],
+    loop: _asyncio.AbstractEventLoop,
+) -> List[_asyncio.Future]:
+    """Call ``wait_until`` for every target, cancelling all of them on error."""
+    futures: List[_asyncio.Future] = []
+    try:
+        for target_time in target_times:
+            futures.append(wait_until(target_time, loop=loop))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return futures
+
+
+class _TimerFuture(_asyncio.Future):
+    """Future that removes itself from its scheduler as soon as it is cancelled.
+
+    This replaces a per-wait done callback, and the entry is gone before the
+    timer can fire for it.  ``scheduler`` is a :class:`_HeapScheduler`.
+    """
+
+    __slots__ = ("_scheduler",)
+
+    def __init__(self, scheduler: Any, *, loop: _asyncio.AbstractEventLoop) -> None:
+        super().__init__(loop=loop)
+        self._scheduler = scheduler
+
+    def cancel(self, *args: Any, **kwargs: Any) -> bool:
+        if not super().cancel(*args, **kwargs):
+            return False
+        try:
+            self._scheduler._discard(self)
+        except Exception as exc:
+            # The future is already cancelled; re-arm failures must not
+            # propagate into Task.cancel() or wait_for().
+            self.get_loop().call_exception_handler(
+                {
+                    "message": "sleep_absolute failed to re-arm the shared timer",
+                    "exception": exc,
+                    "future": self,
+                }
+            )
+        return True
+
+
+class _HeapScheduler:
+    """Pending waits of one event loop, multiplexed onto a single native timer.
+
+    Entries are ``(deadline, tie-breaker, future, wall-clock target)`` in a
+    heap, and the native timer is armed at the head.  Subclasses provide
+    ``_arm(deadline_ns)`` and ``_idle()`` for the native timer, call
+    ``_expire(now_ns)`` when it fires, and may override ``_offset_ns`` and
+    ``_deadline_ns`` when the timer does not run on the wall clock.  Each
+    subclass also defines its own ``_schedulers`` mapping.
+    """
+
+    __slots__ = ("heap", "_armed_ns", "_counter", "_dead")
+
+    _schedulers: "_weakref.WeakKeyDictionary[_asyncio.AbstractEventLoop, _HeapScheduler]"
+
+    def __init__(self) -> None:
+        self.heap: List[Tuple[int, int, _asyncio.Future, int]] = []
+        self._armed_ns = 0
+        self._counter = _itertools.count()
+        # Cancelled entries still in the heap; see _discard().
+        self._dead = 0
+
+    @classmethod
+    def for_loop(cls, loop: _asyncio.AbstractEventLoop) -> "_HeapScheduler":
+        scheduler = cls._schedulers.get(loop)
+        if scheduler is None:
+            cls._check_loop(loop)
+            scheduler = cls(loop)  # type: ignore[call-arg]
+            cls._schedulers[loop] = scheduler
+        return scheduler
+
+    @classmethod
+    def wait_many(
+        cls,
+        target_times: Iterable[_datetime.datetime],
+        loop: _asyncio.AbstractEventLoop,
+    ) -> List[_asyncio.Future]:
+        """Return one future per target, adding the long waits in one batch.
+
+        The native timer is re-armed at most once however many targets are
+        given.  Every future created so far is cancelled on error.
+        """
+        futures: List[_asyncio.Future] = []
+        pending: List[Tuple[int, _asyncio.Future]] = []
+        scheduler: Optional[_HeapScheduler] = None
+        try:
+            for target_time in target_times:
+                target_ns = _datetime_to_ns(target_time)
+                future = _short_wait(target_ns, loop)
+                if future is None:
+                    if scheduler is None:
+                        scheduler = cls.for_loop(loop)
+                    future = _TimerFuture(scheduler, loop=loop)
+                    pending.append((target_ns, future))
+                futures.append(future)
+            if scheduler is not None:
+                scheduler.add_many(pending)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return futures
+
+    @staticmethod
+    def _check_loop(loop: _asyncio.AbstractEventLoop) -> None:
+        """Raise :class:`RuntimeError` if ``loop`` cannot drive this timer."""
+
+    def _offset_ns(self) -> int:
+        return 0
+
+    def _deadline_ns(self, target_ns: int, offset_ns: int) -> int:
+        return target_ns + offset_ns
+
+    def _arm(self, deadline_ns: int) -> None:
+        raise NotImplementedError
+
+    def _idle(self) -> None:
+        raise NotImplementedError
+
+    def add(self, target_ns: int, future: _asyncio.Future) -> None:
+        deadline_ns = self._deadline_ns(target_ns, self._offset_ns())
+        entry = (deadline_ns, next(self._counter), future, target_ns)
+        heap = self.heap
+        _heapq.heappush(heap, entry)
+        if heap[0] is entry:
+            try:
+                self._rearm()
+            except BaseException:
+                _heapq.heappop(heap)
+                raise
+
+    def add_many(self, items: List[Tuple[int, _asyncio.Future]]) -> None:
+        offset_ns = self._offset_ns()
+        counter = self._counter
+        heap = self.heap
+        for target_ns, future in items:
+            deadline_ns = self._deadline_ns(target_ns, offset_ns)
+            heap.append((deadline_ns, next(counter), future, target_ns))
+        _heapq.heapify(heap)
+        try:
+            self._rearm()
+        except BaseException:
+            added = {id(future) for _, future in items}
+            self.heap = [entry for entry in heap if id(entry[2]) not in added]
+            _heapq.heapify(self.heap)
+            raise
+
+    def _rearm(self) -> None:
+        heap = self.heap
+        if heap:
+            deadline_ns = heap[0][0]
+            if deadline_ns != self._armed_ns:
+                self._arm(deadline_ns)
+                self._armed_ns = deadline_ns
+        elif self._armed_ns:
+            self._armed_ns = 0
+            self._idle()
+
+    def _expire(self, now_ns: int) -> None:
+        """Resolve every entry due by ``now_ns`` after the native timer fired."""
+        self._armed_ns = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now_ns:
+            future = _heapq.heappop(heap)[2]
+            if future.cancelled():
+                self._dead -= 1
+            elif not future.done():
+                future.set_result(None)
+        self._rearm()
+
+    def _discard(self, future: _asyncio.Future) -> None:
+        # Called synchronously from _TimerFuture.cancel().  Removing an
+        # arbitrary heap entry is O(n), so cancelled entries are left in place
+        # and only popped once they reach the head; the heap is rebuilt when
+        # they make up more than half of it.
+        self._dead += 1
+        heap = self.heap
+        if self._dead * 2 > len(heap):
+            self._compact()
+        else:
+            while heap and heap[0][2].cancelled():
+                _heapq.heappop(heap)
+                self._dead -= 1
+        self._rearm()
+
+    def _compact(self) -> None:
+        heap = [entry for entry in self.heap if not entry[2].cancelled()]
+        _heapq.heapify(heap)
+        self.heap = heap
+        self._dead = 0
+
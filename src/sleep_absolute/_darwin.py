@@ -1,14 +1,25 @@
-"""macOS implementation backed by Grand Central Dispatch."""
+"""macOS implementation backed by Grand Central Dispatch.
+
+The dispatch timer fires on a GCD worker thread.  Its handler queues the
+timer's context and writes a byte to a wake pipe shared by every wait on the
+event loop, so futures are completed on the loop thread without a
+``call_soon_threadsafe`` hop or any per-wait descriptors.
+"""
 from __future__ import annotations
 
-from typing import Optional
+from typing import Iterable, List, Optional, Set
 import asyncio as _asyncio
+import collections as _collections
 import datetime as _datetime
-import math as _math
+import os as _os
 import ctypes as _ctypes
 import ctypes.util as _ctypes_util
+import threading as _threading
+import weakref as _weakref
+
+from ._common import _datetime_to_ns, _ensure_loop, _short_wait, _wait_each
 
-__all__ = ["wait_until"]
+__all__ = ["wait_until", "wait_until_many"]
 
 _dispatch_lib_path = _ctypes_util.find_library("dispatch")
 if _dispatch_lib_path is None:  # pragma: no cover - platform specific fallback
@@ -77,31 +88,88 @@ _dispatch_get_global_queue = _libdispatch.dispatch_get_global_queue
 _dispatch_get_global_queue.argtypes = (_ctypes.c_long, _ctypes.c_ulong)
 _dispatch_get_global_queue.restype = _ctypes.c_void_p
 
-_DISPATCH_TIME_FOREVER = _ctypes.c_uint64(0xFFFFFFFFFFFFFFFF).value
+_DISPATCH_TIME_FOREVER = 0xFFFFFFFFFFFFFFFF
+_LEEWAY_NS = 1_000_000
+
+# The default-priority global queue is a process-wide singleton.
+_GLOBAL_QUEUE = _dispatch_get_global_queue(0, 0)
+if not _GLOBAL_QUEUE:  # pragma: no cover - platform specific failure
+    raise OSError("Failed to obtain dispatch queue")
 
 
-def _ensure_loop(loop: Optional[_asyncio.AbstractEventLoop]) -> _asyncio.AbstractEventLoop:
-    if loop is not None:
-        return loop
-    try:
-        return _asyncio.get_running_loop()
-    except RuntimeError:
-        return _asyncio.get_event_loop()
+_PyObjectPointer = _ctypes.POINTER(_ctypes.py_object)
 
 
 def _context_from_ptr(ctx: int) -> _TimerContext | None:
     if not ctx:
         return None
-    void_p = _ctypes.c_void_p(ctx)
-    py_obj = _ctypes.cast(void_p, _ctypes.POINTER(_ctypes.py_object))
-    return py_obj.contents.value
+    return _ctypes.cast(ctx, _PyObjectPointer)[0]
+
+
+def _close_pipe(read_fd: int, write_fd: int) -> None:
+    _os.close(read_fd)
+    _os.close(write_fd)
+
+
+class _Waker:
+    """Per-loop wake pipe and queue of contexts whose timers have fired."""
+
+    __slots__ = ("read_fd", "write_fd", "fired", "__weakref__")
+
+    def __init__(self, loop: _asyncio.AbstractEventLoop) -> None:
+        read_fd, write_fd = _os.pipe()
+        try:
+            _os.set_blocking(read_fd, False)
+            _os.set_blocking(write_fd, False)
+            loop.add_reader(read_fd, self._on_ready)
+        except BaseException:
+            _close_pipe(read_fd, write_fd)
+            raise
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.fired: "_collections.deque[_TimerContext]" = _collections.deque()
+        # Pending contexts reference the waker, so the pipe outlives any GCD
+        # handler that may still write to it.
+        _weakref.finalize(self, _close_pipe, read_fd, write_fd)
+
+    def notify(self, context: "_TimerContext") -> None:
+        # Runs on the GCD thread; deque.append is thread-safe.
+        self.fired.append(context)
+        try:
+            _os.write(self.write_fd, b"\x01")
+        except OSError:
+            # A full pipe already guarantees a wakeup.
+            pass
+
+    def _on_ready(self) -> None:
+        try:
+            while _os.read(self.read_fd, 4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        fired = self.fired
+        while fired:
+            fired.popleft()._resolve()
+
+
+_wakers: "_weakref.WeakKeyDictionary[_asyncio.AbstractEventLoop, _Waker]" = (
+    _weakref.WeakKeyDictionary()
+)
+
+
+def _get_waker(loop: _asyncio.AbstractEventLoop) -> _Waker:
+    waker = _wakers.get(loop)
+    if waker is None:
+        waker = _Waker(loop)
+        _wakers[loop] = waker
+    return waker
 
 
 class _TimerContext:
     __slots__ = (
-        "loop",
         "future",
         "timer",
+        "waker",
         "_cancelled",
         "_py_obj_ref",
         "_py_obj_ptr",
@@ -109,16 +177,16 @@ class _TimerContext:
 
     def __init__(
         self,
-        loop: _asyncio.AbstractEventLoop,
         future: _asyncio.Future,
         timer: _ctypes.c_void_p,
+        waker: _Waker,
     ) -> None:
-        self.loop = loop
         self.future = future
         self.timer = timer
+        self.waker = waker
         self._cancelled = False
         self._py_obj_ref: Optional[_ctypes.py_object] = None
-        self._py_obj_ptr: Optional[_ctypes.POINTER(_ctypes.py_object)] = None
+        self._py_obj_ptr: Optional[_PyObjectPointer] = None
 
     def as_context_ptr(self) -> _ctypes.c_void_p:
         if self._py_obj_ref is None or self._py_obj_ptr is None:
@@ -135,27 +203,33 @@ class _TimerContext:
         _dispatch_source_cancel(self.timer)
 
     def release(self) -> None:
+        # Runs on the GCD thread from the cancel handler, which GCD orders
+        # after any in-flight event handler.
         if self.timer is not None:
             _dispatch_release(self.timer)
             self.timer = None
         self._py_obj_ref = None
         self._py_obj_ptr = None
+        _pending.discard(self)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def _on_done(self, _fut: _asyncio.Future) -> None:
+        self.cancel_timer()
+
+
+# Contexts whose dispatch source has not run its cancel handler yet.  GCD holds
+# only a raw pointer to them, so they must not be collected before then.
+_pending: Set[_TimerContext] = set()
 
 
 def _event_handler(ctx: int) -> None:
     context = _context_from_ptr(ctx)
     if context is None:
         return
-    future = context.future
-    if future.done():
-        context.cancel_timer()
-        return
-
-    def _set_result() -> None:
-        if not future.done():
-            future.set_result(None)
-
-    context.loop.call_soon_threadsafe(_set_result)
+    context.waker.notify(context)
     context.cancel_timer()
 
 
@@ -170,22 +244,23 @@ _EVENT_HANDLER = _dispatch_function_t(_event_handler)
 _CANCEL_HANDLER = _dispatch_function_t(_cancel_handler)
 
 
-def _program_timer(timer: _ctypes.c_void_p, target_time: _datetime.datetime) -> None:
-    timestamp = target_time.timestamp()
-    fractional, integral = _math.modf(timestamp)
-    nanoseconds = int(round(fractional * 1_000_000_000))
-    seconds = int(integral)
-    if nanoseconds >= 1_000_000_000:
-        seconds += 1
-        nanoseconds -= 1_000_000_000
+# Reused for every conversion; dispatch_walltime only reads it during the call.
+_SCRATCH_TS = _Timespec()
+_SCRATCH_TS_PTR = _ctypes.byref(_SCRATCH_TS)
+_SCRATCH_LOCK = _threading.Lock()
+
 
-    ts = _Timespec(seconds, nanoseconds)
-    start_time = _dispatch_walltime(_ctypes.byref(ts), 0)
+def _program_timer(timer: _ctypes.c_void_p, target_ns: int) -> None:
+    seconds, nanoseconds = divmod(target_ns, 1_000_000_000)
+    with _SCRATCH_LOCK:
+        _SCRATCH_TS.tv_sec = seconds
+        _SCRATCH_TS.tv_nsec = nanoseconds
+        start_time = _dispatch_walltime(_SCRATCH_TS_PTR, 0)
     _dispatch_source_set_timer(
         timer,
         start_time,
         _DISPATCH_TIME_FOREVER,
-        _ctypes.c_uint64(1_000_000).value,
+        _LEEWAY_NS,
     )
 
 
@@ -196,29 +271,36 @@ def wait_until(
     """Return a future that resolves when ``target_time`` is reached."""
 
     loop = _ensure_loop(loop)
-    future = loop.create_future()
-
-    queue = _dispatch_get_global_queue(0, 0)
-    if not queue:  # pragma: no cover - platform specific failure
-        raise OSError("Failed to obtain dispatch queue")
-
-    timer = _dispatch_source_create(_dispatch_source_type_timer, 0, 0, queue)
+    target_ns = _datetime_to_ns(target_time)
+    future = _short_wait(target_ns, loop)
+    if future is not None:
+        return future
+    if not hasattr(loop, "add_reader") or not hasattr(loop, "remove_reader"):
+        raise RuntimeError("Event loop does not support file descriptor callbacks")
+
+    waker = _get_waker(loop)
+    timer = _dispatch_source_create(_dispatch_source_type_timer, 0, 0, _GLOBAL_QUEUE)
     if not timer:  # pragma: no cover - platform specific failure
         raise OSError("Failed to create dispatch timer")
 
-    context = _TimerContext(loop, future, timer)
-    context_ptr = context.as_context_ptr()
+    future = loop.create_future()
+    context = _TimerContext(future, timer, waker)
+    _pending.add(context)
 
-    _dispatch_set_context(timer, context_ptr)
+    _dispatch_set_context(timer, context.as_context_ptr())
     _dispatch_source_set_event_handler_f(timer, _EVENT_HANDLER)
     _dispatch_source_set_cancel_handler_f(timer, _CANCEL_HANDLER)
 
-    _program_timer(timer, target_time)
+    _program_timer(timer, target_ns)
     _dispatch_resume(timer)
 
-    def _cleanup(_fut: _asyncio.Future) -> None:
-        context.cancel_timer()
-
-    future.add_done_callback(_cleanup)
+    future.add_done_callback(context._on_done)
     return future
 
+
+def wait_until_many(
+    target_times: Iterable[_datetime.datetime],
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> List[_asyncio.Future]:
+    """Return one future per entry of ``target_times``."""
+    return _wait_each(wait_until, target_times, _ensure_loop(loop))
@@ -1,78 +1,233 @@
-"""Linux implementation backed by ``timerfd``."""
+"""Linux implementation backed by ``timerfd``.
+
+The standard library's ``os.timerfd_*`` functions are used when available
+(Python 3.13+); older interpreters bind the syscalls through :mod:`ctypes`.
+Deadlines run on CLOCK_MONOTONIC and are recomputed whenever the wall clock
+is set, which a CLOCK_REALTIME timerfd with TFD_TIMER_CANCEL_ON_SET reports.
+"""
 from __future__ import annotations
 
-from typing import Optional
+from typing import Iterable, List, Optional
 import asyncio as _asyncio
 import datetime as _datetime
-import math as _math
 import os as _os
+import time as _time
 import ctypes as _ctypes
+import ctypes.util as _ctypes_util
 import errno as _errno
+import heapq as _heapq
+import threading as _threading
+import weakref as _weakref
 
-__all__ = ["wait_until"]
+from ._common import (
+    _HeapScheduler,
+    _TimerFuture,
+    _datetime_to_ns,
+    _ensure_loop,
+    _short_wait,
+)
 
-_libc = _ctypes.CDLL("libc.so.6", use_errno=True)
+__all__ = ["wait_until", "wait_until_many"]
 
 _CLOCK_REALTIME = 0
+_CLOCK_MONOTONIC = 1
+_TFD_TIMER_ABSTIME = 1
+_TFD_TIMER_CANCEL_ON_SET = 2
 _TFD_NONBLOCK = 0o4000
 _TFD_CLOEXEC = 0o2000000
 
+if hasattr(_os, "timerfd_create"):
+    # Python 3.13+ ships compiled timerfd bindings, which avoid the libffi
+    # marshalling and ``Structure`` construction of the ctypes path below.
 
-class _Timespec(_ctypes.Structure):
-    _fields_ = [("tv_sec", _ctypes.c_long), ("tv_nsec", _ctypes.c_long)]
+    def _create_timerfd(clockid: int = _CLOCK_MONOTONIC) -> int:
+        return _os.timerfd_create(clockid, flags=_TFD_NONBLOCK | _TFD_CLOEXEC)
 
+    def _set_timerfd_abs(fd: int, deadline_ns: int, flags: int = _TFD_TIMER_ABSTIME) -> None:
+        _os.timerfd_settime_ns(fd, flags=flags, initial=deadline_ns)
 
-class _Itimerspec(_ctypes.Structure):
-    _fields_ = [("it_interval", _Timespec), ("it_value", _Timespec)]
+    def _disarm_timerfd(fd: int) -> None:
+        _os.timerfd_settime_ns(fd, initial=0)
 
+else:
+    def _load_libc() -> _ctypes.CDLL:
+        # Try the glibc soname first: find_library() shells out to ldconfig,
+        # which is far slower than the dlopen it replaces.  musl and other
+        # libcs use different sonames.
+        try:
+            return _ctypes.CDLL("libc.so.6", use_errno=True)
+        except OSError:
+            name = _ctypes_util.find_library("c")
+            if name is None:
+                raise
+            return _ctypes.CDLL(name, use_errno=True)
 
-_timerfd_create = _libc.timerfd_create
-_timerfd_create.argtypes = (_ctypes.c_int, _ctypes.c_int)
-_timerfd_create.restype = _ctypes.c_int
+    _libc = _load_libc()
 
-_timerfd_settime = _libc.timerfd_settime
-_timerfd_settime.argtypes = (
-    _ctypes.c_int,
-    _ctypes.c_int,
-    _ctypes.POINTER(_Itimerspec),
-    _ctypes.POINTER(_Itimerspec),
-)
-_timerfd_settime.restype = _ctypes.c_int
+    class _Timespec(_ctypes.Structure):
+        _fields_ = [("tv_sec", _ctypes.c_long), ("tv_nsec", _ctypes.c_long)]
 
+    class _Itimerspec(_ctypes.Structure):
+        _fields_ = [("it_interval", _Timespec), ("it_value", _Timespec)]
 
-def _ensure_loop(loop: Optional[_asyncio.AbstractEventLoop]) -> _asyncio.AbstractEventLoop:
-    if loop is not None:
-        return loop
-    try:
-        return _asyncio.get_running_loop()
-    except RuntimeError:
-        return _asyncio.get_event_loop()
-
-
-def _create_timerfd() -> int:
-    fd = _timerfd_create(_CLOCK_REALTIME, _TFD_NONBLOCK | _TFD_CLOEXEC)
-    if fd == -1:
-        err = _ctypes.get_errno()
-        raise OSError(err, "Failed to create timerfd")
-    return fd
-
-
-def _program_timerfd(fd: int, target_time: _datetime.datetime) -> None:
-    timestamp = target_time.timestamp()
-    fractional, integral = _math.modf(timestamp)
-    nanoseconds = int(round(fractional * 1_000_000_000))
-    seconds = int(integral)
-    if nanoseconds >= 1_000_000_000:
-        seconds += 1
-        nanoseconds -= 1_000_000_000
-
-    new_value = _Itimerspec(
-        it_interval=_Timespec(0, 0),
-        it_value=_Timespec(seconds, nanoseconds),
+    _timerfd_create = _libc.timerfd_create
+    _timerfd_create.argtypes = (_ctypes.c_int, _ctypes.c_int)
+    _timerfd_create.restype = _ctypes.c_int
+
+    _timerfd_settime = _libc.timerfd_settime
+    _timerfd_settime.argtypes = (
+        _ctypes.c_int,
+        _ctypes.c_int,
+        _ctypes.POINTER(_Itimerspec),
+        _ctypes.POINTER(_Itimerspec),
+    )
+    _timerfd_settime.restype = _ctypes.c_int
+
+    _ZERO_SPEC = _Itimerspec(_Timespec(0, 0), _Timespec(0, 0))
+    # Reused for every arm; the kernel copies it during the syscall.
+    _SCRATCH_SPEC = _Itimerspec()
+    _SCRATCH_PTR = _ctypes.byref(_SCRATCH_SPEC)
+    _SCRATCH_LOCK = _threading.Lock()
+
+    def _create_timerfd(clockid: int = _CLOCK_MONOTONIC) -> int:
+        fd = _timerfd_create(clockid, _TFD_NONBLOCK | _TFD_CLOEXEC)
+        if fd == -1:
+            err = _ctypes.get_errno()
+            raise OSError(err, "Failed to create timerfd")
+        return fd
+
+    def _set_timerfd_abs(fd: int, deadline_ns: int, flags: int = _TFD_TIMER_ABSTIME) -> None:
+        seconds, nanoseconds = divmod(deadline_ns, 1_000_000_000)
+        with _SCRATCH_LOCK:
+            _SCRATCH_SPEC.it_value.tv_sec = seconds
+            _SCRATCH_SPEC.it_value.tv_nsec = nanoseconds
+            result = _timerfd_settime(fd, flags, _SCRATCH_PTR, None)
+        if result != 0:
+            err = _ctypes.get_errno()
+            raise OSError(err, "Failed to set timerfd")
+
+    def _disarm_timerfd(fd: int) -> None:
+        if _timerfd_settime(fd, 0, _ctypes.byref(_ZERO_SPEC), None) != 0:
+            err = _ctypes.get_errno()
+            raise OSError(err, "Failed to disarm timerfd")
+
+
+_FALLBACK_ERRNOS = (_errno.ENOSYS, _errno.ENODEV, _errno.EINVAL)
+
+# Expiry of the clock-change watcher, and the latest deadline ever armed;
+# os.timerfd_settime_ns() rejects values past roughly 2**63.
+_FAR_FUTURE_NS = 1 << 62
+
+
+def _monotonic_offset_ns() -> int:
+    return _time.clock_gettime_ns(_time.CLOCK_MONOTONIC) - _time.time_ns()
+
+
+def _monotonic_deadline_ns(target_ns: int, offset_ns: int) -> int:
+    # The timer runs on CLOCK_MONOTONIC so gradual NTP slewing cannot make it
+    # fire early or late.  Translate the absolute wall-clock target into a
+    # monotonic deadline; a zero ``it_value`` would disarm the timer, so fire
+    # as soon as possible instead.  Far-off targets are clamped and wait for
+    # the next resync.
+    return min(max(target_ns + offset_ns, 1), _FAR_FUTURE_NS)
+
+
+class _Scheduler(_HeapScheduler):
+    """Single timerfd per event loop, armed at the earliest pending deadline."""
+
+    __slots__ = ("fd", "_clock_fd")
+
+    _schedulers: "_weakref.WeakKeyDictionary[_asyncio.AbstractEventLoop, _Scheduler]" = (
+        _weakref.WeakKeyDictionary()
     )
-    if _timerfd_settime(fd, 1, _ctypes.byref(new_value), None) != 0:
-        err = _ctypes.get_errno()
-        raise OSError(err, "Failed to set timerfd")
+
+    def __init__(self, loop: _asyncio.AbstractEventLoop) -> None:
+        super().__init__()
+        fd = _create_timerfd()
+        try:
+            loop.add_reader(fd, self._on_ready)
+        except Exception:
+            _os.close(fd)
+            raise
+        # The descriptor lives as long as the loop.
+        _weakref.finalize(loop, _os.close, fd)
+        self.fd = fd
+        self._clock_fd = self._watch_clock(loop)
+
+    @staticmethod
+    def _check_loop(loop: _asyncio.AbstractEventLoop) -> None:
+        if not hasattr(loop, "add_reader") or not hasattr(loop, "remove_reader"):
+            raise RuntimeError("Event loop does not support file descriptor callbacks")
+
+    def _watch_clock(self, loop: _asyncio.AbstractEventLoop) -> int:
+        # A CLOCK_REALTIME timerfd armed with TFD_TIMER_CANCEL_ON_SET becomes
+        # readable, and read() fails with ECANCELED, whenever the wall clock
+        # is set.  Without it waits still complete, just on the old clock.
+        try:
+            fd = _create_timerfd(_CLOCK_REALTIME)
+        except OSError:
+            return -1
+        try:
+            _set_timerfd_abs(fd, _FAR_FUTURE_NS, _TFD_TIMER_ABSTIME | _TFD_TIMER_CANCEL_ON_SET)
+            loop.add_reader(fd, self._on_clock_set)
+        except OSError:
+            _os.close(fd)
+            return -1
+        _weakref.finalize(loop, _os.close, fd)
+        return fd
+
+    def _offset_ns(self) -> int:
+        return _monotonic_offset_ns()
+
+    def _deadline_ns(self, target_ns: int, offset_ns: int) -> int:
+        return _monotonic_deadline_ns(target_ns, offset_ns)
+
+    def _arm(self, deadline_ns: int) -> None:
+        _set_timerfd_abs(self.fd, deadline_ns)
+
+    def _idle(self) -> None:
+        _disarm_timerfd(self.fd)
+
+    def _on_ready(self) -> None:
+        # Drain the 8-byte expiration count so the level-triggered reader does
+        # not fire again before the timer is re-armed.
+        try:
+            _os.read(self.fd, 8)
+        except (BlockingIOError, InterruptedError):
+            pass
+        self._expire(_time.clock_gettime_ns(_time.CLOCK_MONOTONIC))
+
+    def _on_clock_set(self) -> None:
+        try:
+            _os.read(self._clock_fd, 8)
+        except OSError as exc:
+            if exc.errno != _errno.ECANCELED:
+                return
+        else:
+            return
+        _set_timerfd_abs(
+            self._clock_fd, _FAR_FUTURE_NS, _TFD_TIMER_ABSTIME | _TFD_TIMER_CANCEL_ON_SET
+        )
+        self._resync()
+
+    def _resync(self) -> None:
+        # The wall clock moved relative to CLOCK_MONOTONIC; recompute every
+        # deadline from its wall-clock target and re-arm at the new head.
+        offset_ns = _monotonic_offset_ns()
+        heap = [
+            (_monotonic_deadline_ns(target_ns, offset_ns), counter, future, target_ns)
+            for _, counter, future, target_ns in self.heap
+            if not future.cancelled()
+        ]
+        _heapq.heapify(heap)
+        self.heap = heap
+        self._dead = 0
+        self._armed_ns = 0
+        self._rearm()
+
+
+_schedulers = _Scheduler._schedulers
+_get_scheduler = _Scheduler.for_loop
 
 
 def wait_until(
@@ -81,60 +236,40 @@ def wait_until(
 ) -> _asyncio.Future:
     """Return a future that resolves when ``target_time`` is reached."""
     loop = _ensure_loop(loop)
-    add_reader = getattr(loop, "add_reader", None)
-    remove_reader = getattr(loop, "remove_reader", None)
-    if add_reader is None or remove_reader is None:
-        raise RuntimeError("Event loop does not support file descriptor callbacks")
+    target_ns = _datetime_to_ns(target_time)
+    future = _short_wait(target_ns, loop)
+    if future is not None:
+        return future
 
     try:
-        fd = _create_timerfd()
+        scheduler = _get_scheduler(loop)
+        future = _TimerFuture(scheduler, loop=loop)
+        scheduler.add(target_ns, future)
     except OSError as exc:
-        if exc.errno in (_errno.ENOSYS, _errno.ENODEV, _errno.EINVAL):
+        if exc.errno in _FALLBACK_ERRNOS:
             from . import _timer_create as _fallback  # local import to avoid cycles
 
             return _fallback.wait_until(target_time, loop=loop)
         raise
-    try:
-        _program_timerfd(fd, target_time)
-    except Exception as exc:
-        _os.close(fd)
-        if isinstance(exc, OSError) and exc.errno in (
-            _errno.ENOSYS,
-            _errno.ENODEV,
-            _errno.EINVAL,
-        ):
-            from . import _timer_create as _fallback  # local import to avoid cycles
-
-            return _fallback.wait_until(target_time, loop=loop)
-        raise
-
-    future = loop.create_future()
-    closed = False
+    return future
 
-    def _close_fd() -> None:
-        nonlocal closed
-        if closed:
-            return
-        closed = True
-        try:
-            remove_reader(fd)
-        finally:
-            _os.close(fd)
 
-    def _on_ready() -> None:
-        if not future.done():
-            future.set_result(None)
-        _close_fd()
+def wait_until_many(
+    target_times: Iterable[_datetime.datetime],
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> List[_asyncio.Future]:
+    """Return one future per entry of ``target_times``.
 
+    The waits join the shared timerfd as one batch, so it is re-armed at
+    most once however many targets are given.
+    """
+    loop = _ensure_loop(loop)
+    target_times = list(target_times)
     try:
-        add_reader(fd, _on_ready)
-    except Exception:
-        _close_fd()
-        raise
-
-    def _cleanup_callback(_fut: _asyncio.Future) -> None:
-        _close_fd()
-
-    future.add_done_callback(_cleanup_callback)
-    return future
+        return _Scheduler.wait_many(target_times, loop)
+    except OSError as exc:
+        if exc.errno in _FALLBACK_ERRNOS:
+            from . import _timer_create as _fallback  # local import to avoid cycles
 
+            return _fallback.wait_until_many(target_times, loop=loop)
+        raise
@@ -1,15 +1,35 @@
-"""POSIX timer implementation based on ``timer_create``/``timer_settime``."""
+"""POSIX timer implementation based on ``timer_create``/``timer_settime``.
+
+On Linux, timers started from the thread running the event loop notify
+through a real-time signal directed at that thread (``SIGEV_THREAD_ID``).  The
+signal is blocked there only while such timers are pending and is read from a
+``signalfd`` registered with the loop, so expirations are handled without any
+helper threads.  Other platforms and other threads use ``SIGEV_THREAD``.
+
+Threads and subprocesses started while such a timer is pending inherit the
+blocked signal (``SIGRTMAX - 1``) and nothing unblocks it for them.  Callers
+that need the default mask there should unblock it themselves, e.g. with
+``preexec_fn=lambda: signal.pthread_sigmask(signal.SIG_UNBLOCK,
+{signal.SIGRTMAX - 1})`` for :mod:`subprocess`.
+"""
 from __future__ import annotations
 
-from typing import Optional, Dict
+from typing import Dict, Iterable, List, Optional
 import asyncio as _asyncio
 import datetime as _datetime
-import math as _math
 import ctypes as _ctypes
 import ctypes.util as _ctypes_util
 import errno as _errno
+import itertools as _itertools
+import os as _os
+import signal as _signal
+import struct as _struct
+import threading as _threading
+import weakref as _weakref
 
-__all__ = ["wait_until"]
+from ._common import _datetime_to_ns, _ensure_loop, _short_wait, _wait_each
+
+__all__ = ["wait_until", "wait_until_many"]
 
 
 def _load_timer_library() -> _ctypes.CDLL:
@@ -35,7 +55,11 @@ _libc = _load_timer_library()
 
 _CLOCK_REALTIME = 0
 _TIMER_ABSTIME = 1
+_SIGEV_SIGNAL = 0
 _SIGEV_THREAD = 2
+_SIGEV_THREAD_ID = 4
+_SFD_NONBLOCK = 0o4000
+_SFD_CLOEXEC = 0o2000000
 
 
 class _Sigval(_ctypes.Union):
@@ -55,6 +79,7 @@ class _SigeventThread(_ctypes.Structure):
 class _SigeventUnion(_ctypes.Union):
     _fields_ = [
         ("_sigev_thread", _SigeventThread),
+        ("_tid", _ctypes.c_int),
         ("_pad", _ctypes.c_char * 64),
     ]
 
@@ -95,59 +120,186 @@ _timer_delete = _libc.timer_delete
 _timer_delete.argtypes = (_timer_t,)
 _timer_delete.restype = _ctypes.c_int
 
+try:
+    _signalfd = _libc.signalfd
+except AttributeError:  # pragma: no cover - platform specific
+    _signalfd = None
+
+_USE_SIGNALFD = _signalfd is not None and hasattr(_signal, "SIGRTMIN")
+
+if _USE_SIGNALFD:
+    _TIMER_SIGNO = _signal.SIGRTMAX - 1
+    _ULONG_BITS = 8 * _ctypes.sizeof(_ctypes.c_ulong)
+
+    class _Sigset(_ctypes.Structure):
+        _fields_ = [("val", _ctypes.c_ulong * (1024 // _ULONG_BITS))]
+
+    _signalfd.argtypes = (_ctypes.c_int, _ctypes.POINTER(_Sigset), _ctypes.c_int)
+    _signalfd.restype = _ctypes.c_int
+
+    _TIMER_SIGSET = _Sigset()
+    _TIMER_SIGSET.val[(_TIMER_SIGNO - 1) // _ULONG_BITS] |= 1 << ((_TIMER_SIGNO - 1) % _ULONG_BITS)
+
+    # ``struct signalfd_siginfo`` is 128 bytes with ``ssi_ptr`` at offset 48.
+    _SIGINFO_SIZE = 128
+    _SSI_PTR = _struct.Struct("@Q")
+    _SSI_PTR_OFFSET = 48
+
+_ZERO_SPEC = _Itimerspec(_Timespec(0, 0), _Timespec(0, 0))
+# Scratch buffers reused for every arm; the kernel copies them during the call.
+_SCRATCH_SPEC = _Itimerspec()
+_SCRATCH_PTR = _ctypes.byref(_SCRATCH_SPEC)
+_SCRATCH_LOCK = _threading.Lock()
 
-def _ensure_loop(loop: Optional[_asyncio.AbstractEventLoop]) -> _asyncio.AbstractEventLoop:
-    if loop is not None:
-        return loop
+
+# Per-thread count of pending signalfd timers.  The timer signal is blocked
+# while it is non-zero and unblocked again when it drops back to zero.  Threads
+# and subprocesses started while it is non-zero inherit the blocked signal and
+# keep it; see the module docstring.
+_mask_state = _threading.local()
+
+
+def _on_loop_thread(loop: _asyncio.AbstractEventLoop) -> bool:
     try:
-        return _asyncio.get_running_loop()
+        return _asyncio.get_running_loop() is loop
     except RuntimeError:
-        return _asyncio.get_event_loop()
-
-
-def _timestamp_to_spec(timestamp: float) -> _Itimerspec:
-    fractional, integral = _math.modf(timestamp)
-    nanoseconds = int(round(fractional * 1_000_000_000))
-    seconds = int(integral)
-    if nanoseconds >= 1_000_000_000:
-        seconds += 1
-        nanoseconds -= 1_000_000_000
-    return _Itimerspec(
-        it_interval=_Timespec(0, 0),
-        it_value=_Timespec(seconds, nanoseconds),
-    )
+        return False
 
 
+class _SignalDispatcher:
+    """Per-loop ``signalfd`` that resolves timers on the event loop thread."""
+
+    __slots__ = ("fd", "tid", "contexts")
+
+    def __init__(self, loop: _asyncio.AbstractEventLoop) -> None:
+        # Must run on the loop thread: signals are directed at ``tid``, and
+        # only a signalfd read from that thread observes them.
+        fd = _signalfd(-1, _ctypes.byref(_TIMER_SIGSET), _SFD_NONBLOCK | _SFD_CLOEXEC)
+        if fd == -1:
+            err = _ctypes.get_errno()
+            raise OSError(err, "Failed to create signalfd")
+        self.fd = fd
+        self.tid = _threading.get_native_id()
+        self.contexts: Dict[int, _TimerContext] = {}
+        try:
+            loop.add_reader(fd, self._on_readable)
+        except Exception:
+            _os.close(fd)
+            raise
+        _weakref.finalize(loop, _os.close, fd)
+
+    def _on_readable(self) -> None:
+        contexts = self.contexts
+        while True:
+            try:
+                data = _os.read(self.fd, _SIGINFO_SIZE * 16)
+            except (BlockingIOError, InterruptedError):
+                return
+            for offset in range(0, len(data), _SIGINFO_SIZE):
+                (key,) = _SSI_PTR.unpack_from(data, offset + _SSI_PTR_OFFSET)
+                context = contexts.get(key)
+                if context is not None:
+                    context._resolve()
+
+    def register(self, key: int, context: "_TimerContext") -> None:
+        depth = getattr(_mask_state, "depth", 0)
+        if depth == 0:
+            previous = _signal.pthread_sigmask(_signal.SIG_BLOCK, {_TIMER_SIGNO})
+            _mask_state.unblock = _TIMER_SIGNO not in previous
+        _mask_state.depth = depth + 1
+        self.contexts[key] = context
+
+    def discard(self, key: int) -> None:
+        if self.contexts.pop(key, None) is None:
+            return
+        depth = _mask_state.depth - 1
+        _mask_state.depth = depth
+        if depth == 0 and _mask_state.unblock:
+            # Every timer on this thread has been deleted.  Consume signals
+            # they already queued; unblocked, the default action would kill
+            # the process.
+            self._on_readable()
+            _signal.pthread_sigmask(_signal.SIG_UNBLOCK, {_TIMER_SIGNO})
+
+
+_dispatchers: "_weakref.WeakKeyDictionary[_asyncio.AbstractEventLoop, _SignalDispatcher]" = (
+    _weakref.WeakKeyDictionary()
+)
+# Keys are never reused, so a signal still queued for a deleted timer cannot
+# resolve an unrelated wait.
+_keys = _itertools.count(1)
+
+# SIGEV_THREAD contexts.  The notification thread only carries an integer key:
+# timer_delete() does not wait for a callback that is already running, so the
+# key may outlive the context and must never be dereferenced as a pointer.
 _contexts: Dict[int, "_TimerContext"] = {}
 
 
+def _get_dispatcher(loop: _asyncio.AbstractEventLoop) -> _SignalDispatcher:
+    dispatcher = _dispatchers.get(loop)
+    if dispatcher is None:
+        dispatcher = _SignalDispatcher(loop)
+        _dispatchers[loop] = dispatcher
+    return dispatcher
+
+
 class _TimerContext:
-    __slots__ = ("loop", "future", "timer_id", "_closed", "key")
+    __slots__ = (
+        "loop",
+        "future",
+        "timer_id",
+        "_closed",
+        "_key",
+        "_dispatcher",
+    )
 
     def __init__(self, loop: _asyncio.AbstractEventLoop, future: _asyncio.Future):
         self.loop = loop
         self.future = future
         self.timer_id = _timer_t()
         self._closed = False
-        self.key = id(self)
-        _contexts[self.key] = self
-
-    def start(self, target_time: _datetime.datetime) -> None:
-        sigevent = _Sigevent()
-        sigevent.sigev_notify = _SIGEV_THREAD
-        sigevent.sigev_signo = 0
-        sigevent._sigev_un._sigev_thread.sigev_notify_function = _timer_callback
-        sigevent._sigev_un._sigev_thread.sigev_notify_attributes = None
-        sigevent.sigev_value.sival_ptr = _ctypes.c_void_p(self.key)
+        self._key = 0
+        self._dispatcher: Optional[_SignalDispatcher] = None
+
+    def _register(self) -> int:
+        """Prepare the notification target and return its ``sival_ptr``."""
+        key = self._key = next(_keys)
+        if _USE_SIGNALFD and _on_loop_thread(self.loop):
+            dispatcher = _get_dispatcher(self.loop)
+            if dispatcher.tid == _threading.get_native_id():
+                dispatcher.register(key, self)
+                self._dispatcher = dispatcher
+                return key
+        _contexts[key] = self
+        return key
+
+    def start(self, target_ns: int) -> None:
+        seconds, nanoseconds = divmod(target_ns, 1_000_000_000)
+        sival = self._register()
+        dispatcher = self._dispatcher
 
         timer_id = _timer_t()
-        if _timer_create(_CLOCK_REALTIME, _ctypes.byref(sigevent), _ctypes.byref(timer_id)) != 0:
+        # Create and arm in one critical section so both scratch structs are
+        # filled together and the lock is taken once per timer.
+        armed = -1
+        with _SCRATCH_LOCK:
+            if dispatcher is not None:
+                _SIGEV_TID_TEMPLATE.sigev_value.sival_ptr = sival
+                _SIGEV_TID_TEMPLATE._sigev_un._tid = dispatcher.tid
+                sigevent = _SIGEV_TID_PTR
+            else:
+                _SIGEV_THREAD_TEMPLATE.sigev_value.sival_ptr = sival
+                sigevent = _SIGEV_THREAD_PTR
+            _SCRATCH_SPEC.it_value.tv_sec = seconds
+            _SCRATCH_SPEC.it_value.tv_nsec = nanoseconds
+            created = _timer_create(_CLOCK_REALTIME, sigevent, _ctypes.byref(timer_id))
+            if created == 0:
+                armed = _timer_settime(timer_id, _TIMER_ABSTIME, _SCRATCH_PTR, None)
+        if created != 0:
             err = _ctypes.get_errno()
             raise OSError(err, "Failed to create POSIX timer")
         self.timer_id = timer_id
-
-        spec = _timestamp_to_spec(target_time.timestamp())
-        if _timer_settime(timer_id, _TIMER_ABSTIME, _ctypes.byref(spec), None) != 0:
+        if armed != 0:
             err = _ctypes.get_errno()
             self.cleanup()
             raise OSError(err, "Failed to set POSIX timer")
@@ -159,11 +311,7 @@ class _TimerContext:
         if not timer_id or not timer_id.value:
             return
 
-        zero_spec = _Itimerspec(
-            it_interval=_Timespec(0, 0),
-            it_value=_Timespec(0, 0),
-        )
-        result = _timer_settime(timer_id, 0, _ctypes.byref(zero_spec), None)
+        result = _timer_settime(timer_id, 0, _ctypes.byref(_ZERO_SPEC), None)
         if result != 0:
             err = _ctypes.get_errno()
             if err in (_errno.EINVAL, _errno.ENOENT):
@@ -197,18 +345,34 @@ class _TimerContext:
             if self.timer_id and self.timer_id.value:
                 _timer_delete(self.timer_id)
         finally:
-            _contexts.pop(self.key, None)
             self.timer_id = _timer_t()
+            if self._dispatcher is not None:
+                self._dispatcher.discard(self._key)
+                self._dispatcher = None
+            else:
+                _contexts.pop(self._key, None)
 
 
 @_TimerCallback
 def _timer_callback(sigval: _Sigval) -> None:  # pragma: no cover - executed in C thread
-    key = int(sigval.sival_ptr)
-    context = _contexts.get(key)
+    context = _contexts.get(sigval.sival_ptr or 0)
     if context is not None:
         context._on_timer()
 
 
+# Built once; only the per-timer fields are patched before each timer_create,
+# which copies the struct during the call.
+_SIGEV_THREAD_TEMPLATE = _Sigevent()
+_SIGEV_THREAD_TEMPLATE.sigev_notify = _SIGEV_THREAD
+_SIGEV_THREAD_TEMPLATE._sigev_un._sigev_thread.sigev_notify_function = _timer_callback
+_SIGEV_THREAD_PTR = _ctypes.byref(_SIGEV_THREAD_TEMPLATE)
+if _USE_SIGNALFD:
+    _SIGEV_TID_TEMPLATE = _Sigevent()
+    _SIGEV_TID_TEMPLATE.sigev_notify = _SIGEV_THREAD_ID
+    _SIGEV_TID_TEMPLATE.sigev_signo = _TIMER_SIGNO
+    _SIGEV_TID_PTR = _ctypes.byref(_SIGEV_TID_TEMPLATE)
+
+
 def wait_until(
     target_time: _datetime.datetime,
     loop: Optional[_asyncio.AbstractEventLoop] = None,
@@ -216,11 +380,15 @@ def wait_until(
     """Return a future that resolves when ``target_time`` is reached."""
 
     loop = _ensure_loop(loop)
+    target_ns = _datetime_to_ns(target_time)
+    future = _short_wait(target_ns, loop)
+    if future is not None:
+        return future
     future = loop.create_future()
     context = _TimerContext(loop, future)
 
     try:
-        context.start(target_time)
+        context.start(target_ns)
     except Exception:
         try:
             context.cancel_timer()
@@ -237,3 +405,10 @@ def wait_until(
     future.add_done_callback(_on_done)
     return future
 
+
+def wait_until_many(
+    target_times: Iterable[_datetime.datetime],
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> List[_asyncio.Future]:
+    """Return one future per entry of ``target_times``."""
+    return _wait_each(wait_until, target_times, _ensure_loop(loop))
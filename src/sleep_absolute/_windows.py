@@ -1,14 +1,28 @@
-"""Windows implementation based on waitable timers."""
+"""Windows implementation based on waitable timers.
+
+All waits on an event loop share one waitable timer armed at the earliest
+pending deadline, so the proactor only tracks a single handle per loop.
+"""
 from __future__ import annotations
 
-from typing import Optional
+from typing import Iterable, List, Optional
 import asyncio as _asyncio
 import datetime as _datetime
-import math as _math
 import ctypes as _ctypes
+import heapq as _heapq
+import time as _time
+import weakref as _weakref
 from ctypes import wintypes as _wintypes
 
-__all__ = ["wait_until"]
+from ._common import (
+    _HeapScheduler,
+    _TimerFuture,
+    _datetime_to_ns,
+    _ensure_loop,
+    _short_wait,
+)
+
+__all__ = ["wait_until", "wait_until_many"]
 
 _kernel32 = _ctypes.WinDLL("kernel32", use_last_error=True)  # pragma: no cover - windows only
 
@@ -16,6 +30,15 @@ _CreateWaitableTimerW = _kernel32.CreateWaitableTimerW  # pragma: no cover - win
 _CreateWaitableTimerW.argtypes = (_ctypes.c_void_p, _wintypes.BOOL, _wintypes.LPCWSTR)
 _CreateWaitableTimerW.restype = _wintypes.HANDLE
 
+_CreateWaitableTimerExW = _kernel32.CreateWaitableTimerExW  # pragma: no cover - windows only
+_CreateWaitableTimerExW.argtypes = (
+    _ctypes.c_void_p,
+    _wintypes.LPCWSTR,
+    _wintypes.DWORD,
+    _wintypes.DWORD,
+)
+_CreateWaitableTimerExW.restype = _wintypes.HANDLE
+
 _SetWaitableTimer = _kernel32.SetWaitableTimer  # pragma: no cover - windows only
 _SetWaitableTimer.argtypes = (
     _wintypes.HANDLE,
@@ -27,60 +50,155 @@ _SetWaitableTimer.argtypes = (
 )
 _SetWaitableTimer.restype = _wintypes.BOOL
 
+_CancelWaitableTimer = _kernel32.CancelWaitableTimer  # pragma: no cover - windows only
+_CancelWaitableTimer.argtypes = (_wintypes.HANDLE,)
+_CancelWaitableTimer.restype = _wintypes.BOOL
+
 _CloseHandle = _kernel32.CloseHandle  # pragma: no cover - windows only
 _CloseHandle.argtypes = (_wintypes.HANDLE,)
 _CloseHandle.restype = _wintypes.BOOL
 
-_WINDOWS_TICK = 10_000_000
-_EPOCH_DIFFERENCE_SECONDS = 11644473600
+_CREATE_WAITABLE_TIMER_MANUAL_RESET = 0x00000001
+_CREATE_WAITABLE_TIMER_HIGH_RESOLUTION = 0x00000002
+_TIMER_ALL_ACCESS = 0x001F0003
+_ERROR_INVALID_PARAMETER = 87
 
+# 100ns ticks between 1601-01-01 (FILETIME epoch) and 1970-01-01.
+_EPOCH_DIFF_TICKS = 116444736000000000
 
-def _ensure_loop(loop: Optional[_asyncio.AbstractEventLoop]) -> _asyncio.AbstractEventLoop:
-    if loop is not None:
-        return loop
-    try:
-        return _asyncio.get_running_loop()
-    except RuntimeError:
-        return _asyncio.get_event_loop()
 
+def _ns_to_windows_ticks(target_ns: int) -> int:
+    return target_ns // 100 + _EPOCH_DIFF_TICKS
 
-def _unix_to_windows_ticks(timestamp: float) -> int:
-    whole, frac = _math.modf(timestamp)
-    fractional_ticks = int(round(frac * _WINDOWS_TICK))
-    whole_ticks = int(whole) * _WINDOWS_TICK
-    if fractional_ticks >= _WINDOWS_TICK:
-        whole_ticks += _WINDOWS_TICK
-        fractional_ticks -= _WINDOWS_TICK
-    return whole_ticks + fractional_ticks + _EPOCH_DIFFERENCE_SECONDS * _WINDOWS_TICK
-
-
-def wait_until(
-    target_time: _datetime.datetime,
-    loop: Optional[_asyncio.AbstractEventLoop] = None,
-) -> _asyncio.Future:
-    """Return a future that resolves when ``target_time`` is reached."""
-    loop = _ensure_loop(loop)
-    proactor = getattr(loop, "_proactor", None)
-    if proactor is None:
-        raise RuntimeError("Event loop does not expose a Windows proactor")
 
-    due_time_value = _ctypes.c_longlong(_unix_to_windows_ticks(target_time.timestamp()))
+def _create_timer() -> int:
+    # High resolution timers (Windows 10 1803+) are not bound to the ~15.6ms
+    # system tick.  Older releases reject the flag with ERROR_INVALID_PARAMETER.
+    handle = _CreateWaitableTimerExW(
+        None,
+        None,
+        _CREATE_WAITABLE_TIMER_MANUAL_RESET | _CREATE_WAITABLE_TIMER_HIGH_RESOLUTION,
+        _TIMER_ALL_ACCESS,
+    )
+    if handle:
+        return handle
+    err = _ctypes.get_last_error()
+    if err != _ERROR_INVALID_PARAMETER:
+        raise OSError(err, "Failed to create waitable timer")
 
     handle = _CreateWaitableTimerW(None, True, None)
     if not handle:
         err = _ctypes.get_last_error()
         raise OSError(err, "Failed to create waitable timer")
+    return handle
+
+
+class _Scheduler(_HeapScheduler):
+    """Single waitable timer per event loop, armed at the earliest deadline.
+
+    Deadlines are wall-clock nanoseconds, converted to FILETIME ticks when the
+    timer is armed.
+    """
+
+    __slots__ = ("handle", "_loop_ref", "_waiter", "_due_time")
+
+    _schedulers: "_weakref.WeakKeyDictionary[_asyncio.AbstractEventLoop, _Scheduler]" = (
+        _weakref.WeakKeyDictionary()
+    )
+
+    def __init__(self, loop: _asyncio.AbstractEventLoop) -> None:
+        super().__init__()
+        handle = _create_timer()
+        # The handle lives as long as the loop.  Only a weak reference to the
+        # loop is kept so the scheduler does not keep it alive.
+        _weakref.finalize(loop, _CloseHandle, handle)
+        self.handle = handle
+        self._loop_ref = _weakref.ref(loop)
+        self._waiter: Optional[_asyncio.Future] = None
+        # Only touched from the loop thread, so one buffer per scheduler is
+        # enough; the array decays to the LARGE_INTEGER pointer directly.
+        self._due_time = (_ctypes.c_longlong * 1)()
+
+    @staticmethod
+    def _check_loop(loop: _asyncio.AbstractEventLoop) -> None:
+        if getattr(loop, "_proactor", None) is None:
+            raise RuntimeError("Event loop does not expose a Windows proactor")
+
+    def _arm(self, deadline_ns: int) -> None:
+        due_time = self._due_time
+        due_time[0] = _ns_to_windows_ticks(deadline_ns)
+        if not _SetWaitableTimer(self.handle, due_time, 0, None, None, False):
+            err = _ctypes.get_last_error()
+            raise OSError(err, "Failed to set waitable timer")
+        if self._waiter is None:
+            self._wait()
+
+    def _wait(self) -> None:
+        loop = self._loop_ref()
+        waiter = loop._proactor.wait_for_handle(self.handle, None)
+        waiter.add_done_callback(self._on_signalled)
+        self._waiter = waiter
+
+    def _idle(self) -> None:
+        # Cancelling leaves a manual-reset timer signalled; the next _arm()
+        # resets it before a new wait is registered.
+        _CancelWaitableTimer(self.handle)
+        if self._waiter is not None:
+            waiter = self._waiter
+            self._waiter = None
+            waiter.cancel()
+
+    def _on_signalled(self, waiter: _asyncio.Future) -> None:
+        if waiter is not self._waiter:
+            return
+        self._waiter = None
+        if waiter.cancelled():
+            self._armed_ns = 0
+            return
+        exc = waiter.exception()
+        if exc is not None:
+            self._armed_ns = 0
+            heap = self.heap
+            while heap:
+                future = _heapq.heappop(heap)[2]
+                if not future.done():
+                    future.set_exception(exc)
+            self._dead = 0
+            return
+        # Before Python 3.13 time_ns() only advances every ~15.6ms and may
+        # still read earlier than the high-resolution timer that just fired;
+        # everything up to the armed deadline is due regardless.
+        self._expire(max(_time.time_ns(), self._armed_ns))
+
+
+_schedulers = _Scheduler._schedulers
+_get_scheduler = _Scheduler.for_loop
 
-    if not _SetWaitableTimer(handle, _ctypes.byref(due_time_value), 0, None, None, False):
-        err = _ctypes.get_last_error()
-        _CloseHandle(handle)
-        raise OSError(err, "Failed to set waitable timer")
 
-    future = proactor.wait_for_handle(handle, None)
+def wait_until(
+    target_time: _datetime.datetime,
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> _asyncio.Future:
+    """Return a future that resolves when ``target_time`` is reached."""
+    loop = _ensure_loop(loop)
+    target_ns = _datetime_to_ns(target_time)
+    future = _short_wait(target_ns, loop)
+    if future is not None:
+        return future
+
+    scheduler = _get_scheduler(loop)
+    future = _TimerFuture(scheduler, loop=loop)
+    scheduler.add(target_ns, future)
+    return future
 
-    def _cleanup_callback(_fut: _asyncio.Future) -> None:
-        _CloseHandle(handle)
 
-    future.add_done_callback(_cleanup_callback)
-    return future
+def wait_until_many(
+    target_times: Iterable[_datetime.datetime],
+    loop: Optional[_asyncio.AbstractEventLoop] = None,
+) -> List[_asyncio.Future]:
+    """Return one future per entry of ``target_times``.
 
+    The waits join the shared waitable timer as one batch, so it is re-armed
+    at most once however many targets are given.
+    """
+    return _Scheduler.wait_many(target_times, _ensure_loop(loop))
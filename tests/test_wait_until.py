@@ -1,12 +1,21 @@
 import asyncio
 import datetime
 import importlib
+import signal
 import unittest
+from unittest import mock
+
+from sleep_absolute._common import _datetime_to_ns
 
 try:
-    from sleep_absolute import wait_until
+    from sleep_absolute import wait_until, wait_until_many
 except NotImplementedError:  # pragma: no cover - unsupported platform
-    wait_until = None  # type: ignore[assignment]
+    wait_until = wait_until_many = None  # type: ignore[assignment]
+
+try:
+    _linux_impl = importlib.import_module("sleep_absolute._linux")
+except (ImportError, OSError, AttributeError):  # pragma: no cover - platform specific
+    _linux_impl = None  # type: ignore[assignment]
 
 try:
     _posix_impl = importlib.import_module("sleep_absolute._timer_create")
@@ -14,6 +23,32 @@ except (ImportError, OSError):  # pragma: no cover - platform specific
     _posix_impl = None  # type: ignore[assignment]
 
 
+class DatetimeToNsTests(unittest.TestCase):
+    def test_aware_datetime(self) -> None:
+        target = datetime.datetime(
+            2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone(datetime.timedelta(hours=9))
+        )
+        self.assertEqual(_datetime_to_ns(target), 1704132245_678901000)
+
+    def test_naive_datetime_is_local_time(self) -> None:
+        target = datetime.datetime(2024, 6, 1, 12, 30, 15, 250000)
+        seconds, nanoseconds = divmod(_datetime_to_ns(target), 1_000_000_000)
+        self.assertEqual(seconds, int(target.timestamp()))
+        self.assertEqual(nanoseconds, 250_000_000)
+
+    def test_naive_datetime_is_exact_at_range_edges(self) -> None:
+        for target in (
+            datetime.datetime(1969, 12, 31, 23, 59, 59, 999999),
+            datetime.datetime(9999, 12, 30, 23, 59, 59, 999999),
+        ):
+            aware = target.astimezone()
+            self.assertEqual(_datetime_to_ns(target), _datetime_to_ns(aware))
+
+    def test_datetime_before_epoch(self) -> None:
+        target = datetime.datetime(1969, 12, 31, 23, 59, 59, 500000, tzinfo=datetime.timezone.utc)
+        self.assertEqual(_datetime_to_ns(target), -500_000_000)
+
+
 @unittest.skipIf(wait_until is None, "sleep_absolute is unsupported on this platform")
 class WaitUntilTests(unittest.IsolatedAsyncioTestCase):
     async def test_waits_until_target_time(self) -> None:
@@ -25,6 +60,16 @@ class WaitUntilTests(unittest.IsolatedAsyncioTestCase):
         # Ensure we did not wake up immediately.
         self.assertGreaterEqual((after - before).total_seconds(), 0.09)
 
+    async def test_past_target_resolves_immediately(self) -> None:
+        target = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        await asyncio.wait_for(wait_until(target), timeout=1)
+
+    async def test_short_wait_does_not_resolve_early(self) -> None:
+        for _ in range(20):
+            target = datetime.datetime.now() + datetime.timedelta(microseconds=1500)
+            await wait_until(target)
+            self.assertGreaterEqual(datetime.datetime.now(), target)
+
     async def test_cancellation(self) -> None:
         target = datetime.datetime.now() + datetime.timedelta(seconds=1)
         fut = wait_until(target)
@@ -34,6 +79,101 @@ class WaitUntilTests(unittest.IsolatedAsyncioTestCase):
             await fut
         self.assertTrue(fut.cancelled())
 
+    async def test_wait_until_many_preserves_order(self) -> None:
+        now = datetime.datetime.now()
+        targets = [now + datetime.timedelta(milliseconds=delay) for delay in (60, 0, 30)]
+        futures = wait_until_many(targets)
+        self.assertEqual(len(futures), 3)
+        await futures[2]
+        self.assertFalse(futures[0].done())
+        await asyncio.gather(*futures)
+        self.assertGreaterEqual(datetime.datetime.now(), targets[0])
+
+
+@unittest.skipIf(_linux_impl is None, "timerfd implementation unavailable")
+class TimerfdTests(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_share_one_timerfd(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = datetime.datetime.now()
+        futures = [
+            _linux_impl.wait_until(now + datetime.timedelta(milliseconds=delay))
+            for delay in (60, 20, 40)
+        ]
+        scheduler = _linux_impl._schedulers[loop]
+        self.assertEqual(len(scheduler.heap), 3)
+        await futures[1]
+        self.assertFalse(futures[2].done())
+        await asyncio.gather(*futures)
+        self.assertEqual(scheduler.heap, [])
+        self.assertIs(_linux_impl._schedulers[loop], scheduler)
+
+    async def test_cancelled_wait_leaves_heap(self) -> None:
+        loop = asyncio.get_running_loop()
+        fut = _linux_impl.wait_until(datetime.datetime.now() + datetime.timedelta(seconds=1))
+        fut.cancel()
+        self.assertEqual(_linux_impl._schedulers[loop].heap, [])
+        with self.assertRaises(asyncio.CancelledError):
+            await fut
+
+    async def test_cancel_reports_rearm_failure(self) -> None:
+        loop = asyncio.get_running_loop()
+        contexts = []
+        loop.set_exception_handler(lambda _loop, context: contexts.append(context))
+        fut = _linux_impl.wait_until(datetime.datetime.now() + datetime.timedelta(seconds=1))
+        with mock.patch.object(_linux_impl._Scheduler, "_rearm", side_effect=OSError(9, "boom")):
+            self.assertTrue(fut.cancel())
+        self.assertTrue(fut.cancelled())
+        self.assertIsInstance(contexts[0]["exception"], OSError)
+
+    async def test_far_future_target_is_clamped(self) -> None:
+        loop = asyncio.get_running_loop()
+        fut = _linux_impl.wait_until(datetime.datetime(9999, 1, 1))
+        scheduler = _linux_impl._schedulers[loop]
+        self.assertEqual(scheduler.heap[0][0], _linux_impl._FAR_FUTURE_NS)
+        self.assertFalse(fut.done())
+        fut.cancel()
+        self.assertEqual(scheduler.heap, [])
+
+    async def test_cancelled_waits_are_dropped_lazily(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = datetime.datetime.now()
+        futures = [
+            _linux_impl.wait_until(now + datetime.timedelta(seconds=delay))
+            for delay in (1, 2, 3, 4)
+        ]
+        scheduler = _linux_impl._schedulers[loop]
+        futures[3].cancel()
+        self.assertEqual(len(scheduler.heap), 4)
+        futures[0].cancel()
+        self.assertEqual(len(scheduler.heap), 3)
+        futures[2].cancel()
+        self.assertEqual([entry[2] for entry in scheduler.heap], [futures[1]])
+        futures[1].cancel()
+        self.assertEqual(scheduler.heap, [])
+
+    async def test_wait_until_many_arms_once(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = datetime.datetime.now()
+        targets = [now + datetime.timedelta(milliseconds=delay) for delay in (50, 20, 40)]
+        scheduler = _linux_impl._get_scheduler(loop)
+        with mock.patch.object(
+            _linux_impl, "_set_timerfd_abs", wraps=_linux_impl._set_timerfd_abs
+        ) as set_timerfd:
+            futures = _linux_impl.wait_until_many(targets)
+        self.assertEqual(set_timerfd.call_count, 1)
+        self.assertEqual(len(scheduler.heap), 3)
+        await asyncio.gather(*futures)
+
+    async def test_clock_step_recomputes_deadlines(self) -> None:
+        loop = asyncio.get_running_loop()
+        fut = _linux_impl.wait_until(datetime.datetime.now() + datetime.timedelta(seconds=30))
+        scheduler = _linux_impl._schedulers[loop]
+        time_ns = _linux_impl._time.time_ns
+        # Simulate the wall clock being set a minute ahead.
+        with mock.patch.object(_linux_impl._time, "time_ns", lambda: time_ns() + 60 * 10**9):
+            scheduler._resync()
+        await asyncio.wait_for(fut, 1)
+
 
 @unittest.skipIf(_posix_impl is None, "timer_create implementation unavailable")
 class TimerCreateTests(unittest.IsolatedAsyncioTestCase):
@@ -56,13 +196,42 @@ class TimerCreateTests(unittest.IsolatedAsyncioTestCase):
 
     async def test_cancellation_releases_native_timer(self) -> None:
         target = datetime.datetime.now() + datetime.timedelta(seconds=1)
-        fut = _posix_impl.wait_until(target)
-        self.assertGreaterEqual(len(_posix_impl._contexts), 1)
+        with mock.patch.object(
+            _posix_impl, "_timer_delete", wraps=_posix_impl._timer_delete
+        ) as timer_delete:
+            fut = _posix_impl.wait_until(target)
+            timer_delete.assert_not_called()
+            fut.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await fut
+            await asyncio.sleep(0)
+            timer_delete.assert_called_once()
+
+    @unittest.skipUnless(getattr(_posix_impl, "_USE_SIGNALFD", False), "signalfd unavailable")
+    async def test_signalfd_dispatch_releases_context(self) -> None:
+        target = datetime.datetime.now() + datetime.timedelta(milliseconds=50)
+        await _posix_impl.wait_until(target)
+        dispatcher = _posix_impl._dispatchers[asyncio.get_running_loop()]
+        self.assertEqual(dispatcher.contexts, {})
+
+    @unittest.skipUnless(getattr(_posix_impl, "_USE_SIGNALFD", False), "signalfd unavailable")
+    async def test_signal_mask_restored_when_idle(self) -> None:
+        signo = _posix_impl._TIMER_SIGNO
+        fut = _posix_impl.wait_until(datetime.datetime.now() + datetime.timedelta(seconds=1))
+        self.assertIn(signo, signal.pthread_sigmask(signal.SIG_BLOCK, []))
         fut.cancel()
         with self.assertRaises(asyncio.CancelledError):
             await fut
         await asyncio.sleep(0)
-        self.assertEqual(len(_posix_impl._contexts), 0)
+        self.assertNotIn(signo, signal.pthread_sigmask(signal.SIG_BLOCK, []))
+
+    @unittest.skipUnless(getattr(_posix_impl, "_USE_SIGNALFD", False), "signalfd unavailable")
+    async def test_wait_from_other_thread_uses_thread_notification(self) -> None:
+        loop = asyncio.get_running_loop()
+        target = datetime.datetime.now() + datetime.timedelta(milliseconds=50)
+        fut = await loop.run_in_executor(None, _posix_impl.wait_until, target, loop)
+        await asyncio.wait_for(fut, 1)
+        self.assertNotIn(loop, _posix_impl._dispatchers)
 
 
 if __name__ == "__main__":